@@ -1,24 +1,38 @@
 import asyncio
-import json
+import contextlib
+import io
 import logging
 import os
 import signal
-import tempfile
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from pathlib import Path
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
 
 import boto3
+import orjson
+from botocore.config import Config as BotoConfig
 import pandas as pd
 from dotenv import load_dotenv
 from tenacity import RetryError, retry, stop_after_delay, wait_exponential
+import uvloop
 import websockets
 
 
 load_dotenv()
 
+# Upper bound on frames the buffering task pulls from the queue per wake-up.
+WS_BATCH_MAX_FRAMES = 64
+# Frames held between the WebSocket reader and the buffering task before drops.
+TRADE_QUEUE_MAX_FRAMES = 8192
+# Batches uploading at once; past this the buffering task waits for a slot, so
+# a slow S3 backs up into the bounded frame queue instead of growing memory.
+UPLOAD_MAX_IN_FLIGHT = 2
+# Fastest deflate level; trade CSVs are digit-heavy and lose little ratio.
+CSV_GZIP_COMPRESSION = {"method": "gzip", "compresslevel": 1}
+
 
 def _get_env(name: str, default: Optional[str] = None) -> str:
     value = os.getenv(name, default)
@@ -70,23 +84,60 @@ class Config:
 
 
 class TradeBuffer:
-    """Aggregates trades until size, byte, or time threshold is reached."""
-
-    def __init__(self, max_trades: int, max_seconds: int, max_bytes: int) -> None:
+    """Aggregates trades until size, byte, or time threshold is reached.
+
+    The time threshold is a timer on ``loop``, so the buffer must be fed from
+    code running on that event loop.
+    """
+
+    def __init__(
+        self,
+        max_trades: int,
+        max_seconds: int,
+        max_bytes: int,
+        loop: asyncio.AbstractEventLoop,
+    ) -> None:
+        self.loop = loop
         self.max_trades = max_trades
         self.max_seconds = max_seconds
         self.max_bytes = max_bytes
         self.records: List[Dict[str, Any]] = []
         self.window_start: Optional[datetime] = None
         self.byte_count: int = 0
-
-    def add(self, trade: Dict[str, Any]) -> bool:
+        self._time_expired = False
+        self._time_handle: Optional[asyncio.TimerHandle] = None
+
+    def _start_window(self) -> None:
+        self.window_start = datetime.now(timezone.utc)
+        # The loop flips the age flag once, so should_flush never reads the clock.
+        self._time_expired = False
+        self._time_handle = self.loop.call_later(self.max_seconds, self._mark_time_expired)
+
+    def _mark_time_expired(self) -> None:
+        self._time_expired = True
+
+    def add_many(self, trades: List[Dict[str, Any]], start: int = 0) -> int:
+        """Buffer trades[start:] up to the max_trades cap.
+
+        Returns the index of the first trade not taken; callers flush and call
+        again with it. The byte threshold is checked per call, so a batch may
+        overshoot max_bytes by up to one call's worth of trades.
+        """
+        capacity = self.max_trades - len(self.records)
         if not self.records:
-            self.window_start = datetime.now(timezone.utc)
-        self.records.append(trade)
-        approx = len(json.dumps(trade, separators=(",", ":")).encode("utf-8"))
-        self.byte_count += approx
-        return self.should_flush()
+            capacity = max(capacity, 1)
+        end = min(len(trades), start + capacity)
+        if end <= start:
+            return start
+        if not self.records:
+            self._start_window()
+        taken = trades[start:end]
+        self.records.extend(taken)
+        size = 0
+        for trade in taken:
+            size += len(orjson.dumps(trade))
+        self.byte_count += size
+        return end
 
     def should_flush(self) -> bool:
         if not self.records:
@@ -95,9 +146,7 @@ class TradeBuffer:
             return True
         if self.byte_count >= self.max_bytes:
             return True
-        assert self.window_start is not None
-        elapsed = (datetime.now(timezone.utc) - self.window_start).total_seconds()
-        return elapsed >= self.max_seconds
+        return self._time_expired
 
     def flush(self) -> Dict[str, Any]:
         if not self.records:
@@ -108,15 +157,21 @@ class TradeBuffer:
                 "byte_count": 0,
             }
         window_start = self.window_start or datetime.now(timezone.utc)
+        # Hand the filled list to the uploader and start a fresh one rather than
+        # copying every record reference on each flush.
         payload = {
-            "records": self.records[:],
+            "records": self.records,
             "window_start": window_start,
             "window_end": datetime.now(timezone.utc),
             "byte_count": self.byte_count,
         }
-        self.records.clear()
+        self.records = []
         self.window_start = None
         self.byte_count = 0
+        if self._time_handle is not None:
+            self._time_handle.cancel()
+            self._time_handle = None
+        self._time_expired = False
         return payload
 
 
@@ -129,38 +184,42 @@ class TradeBatchWriter:
         if fmt not in {"parquet", "csv"}:
             raise ValueError("FILE_FORMAT must be 'parquet' or 'csv'")
         self.fmt = fmt
+        self.extension = "parquet" if fmt == "parquet" else "csv.gz"
 
     def _build_key(self, timestamp: datetime) -> str:
         ts = timestamp.astimezone(timezone.utc)
-        path = ts.strftime("%Y/%m/%d/%H/%M")
-        extension = "parquet" if self.fmt == "parquet" else "csv.gz"
-        return f"{self.prefix}{path}/batch-{uuid.uuid4().hex}.{extension}"
+        path = f"{ts.year:04d}/{ts.month:02d}/{ts.day:02d}/{ts.hour:02d}/{ts.minute:02d}"
+        return f"{self.prefix}{path}/batch-{uuid.uuid4().hex}.{self.extension}"
 
     def write(self, records: List[Dict[str, Any]], window_start: datetime) -> str:
         df = pd.DataFrame.from_records(records)
         if df.empty:
             raise ValueError("Attempted to persist empty batch")
         key = self._build_key(window_start)
-        suffix = ".parquet" if self.fmt == "parquet" else ".csv.gz"
-
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            path = Path(tmp.name)
-        try:
-            if self.fmt == "parquet":
-                df.to_parquet(path, index=False)
-            else:
-                df.to_csv(path, index=False, compression="gzip")
-            self.client.upload_file(str(path), self.bucket, key)
-        finally:
-            path.unlink(missing_ok=True)
+
+        # Serialize in memory so each batch is written once and streamed
+        # straight to S3 instead of round-tripping through a temp file.
+        body = io.BytesIO()
+        if self.fmt == "parquet":
+            df.to_parquet(body, index=False)
+        else:
+            df.to_csv(body, index=False, compression=CSV_GZIP_COMPRESSION)
+        body.seek(0)
+        self.client.upload_fileobj(body, self.bucket, key)
         return key
 
 
+@lru_cache(maxsize=4096)
+def _iso_from_ms(timestamp_ms: int) -> str:
+    """Format a Binance millisecond timestamp; bursts share the same few values."""
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).isoformat()
+
+
 def normalize_trade(message: Dict[str, Any]) -> Dict[str, Any]:
     """Normalize a raw Binance trade payload into our schema."""
     return {
-        "event_time": datetime.fromtimestamp(message["E"] / 1000, tz=timezone.utc).isoformat(),
-        "trade_time": datetime.fromtimestamp(message["T"] / 1000, tz=timezone.utc).isoformat(),
+        "event_time": _iso_from_ms(message["E"]),
+        "trade_time": _iso_from_ms(message["T"]),
         "symbol": message["s"],
         "trade_id": message["t"],
         "price": float(message["p"]),
@@ -174,69 +233,189 @@ def normalize_trade(message: Dict[str, Any]) -> Dict[str, Any]:
 async def collect(config: Config) -> None:
     logging.info("Starting collector with %s", config)
     session = boto3.session.Session(region_name=config.region)
-    s3 = session.client("s3")
-    buffer = TradeBuffer(config.batch_max_trades, config.batch_max_seconds, config.batch_max_bytes)
+    # One long-lived client shared by upload threads: keep TLS connections
+    # warm and let botocore own retries/backoff.
+    s3 = session.client(
+        "s3",
+        config=BotoConfig(
+            max_pool_connections=32,
+            tcp_keepalive=True,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        ),
+    )
+    loop = asyncio.get_running_loop()
+    buffer = TradeBuffer(config.batch_max_trades, config.batch_max_seconds, config.batch_max_bytes, loop)
     writer = TradeBatchWriter(s3, config.bucket, config.prefix, config.file_format)
     stop_event = asyncio.Event()
+    pending_uploads: Set["asyncio.Task[None]"] = set()
+    upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_MAX_IN_FLIGHT, thread_name_prefix="upload")
+    upload_slots = asyncio.Semaphore(UPLOAD_MAX_IN_FLIGHT)
+    frame_queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=TRADE_QUEUE_MAX_FRAMES)
+    dropped_frames = 0
 
     def _handle_stop(*_):
         logging.warning("Shutdown signal received")
         stop_event.set()
 
     for sig in (signal.SIGINT, signal.SIGTERM):
-        signal.signal(sig, _handle_stop)
+        loop.add_signal_handler(sig, _handle_stop)
+
+    def _upload_done(task: "asyncio.Task[None]") -> None:
+        pending_uploads.discard(task)
+        upload_slots.release()
+
+    async def _schedule_flush() -> None:
+        # Wait for an upload slot, snapshot the buffer, then serialize/upload
+        # in the background so the WebSocket reader keeps draining frames.
+        await upload_slots.acquire()
+        payload = buffer.flush()
+        if not payload["records"]:
+            upload_slots.release()
+            return
+        task = asyncio.create_task(upload_batch(payload, writer, config, upload_executor))
+        pending_uploads.add(task)
+        task.add_done_callback(_upload_done)
+
+    async def _buffer_frames(frames: List[Any]) -> None:
+        trades = []
+        for raw in frames:
+            try:
+                message = orjson.loads(raw)
+                if "result" in message:
+                    continue
+                trades.append(normalize_trade(message))
+            except Exception:
+                # Skip only the bad frame; the rest of the batch is still valid.
+                logging.exception("Skipping malformed frame: %r", raw)
+                continue
+        offset = 0
+        while True:
+            offset = buffer.add_many(trades, offset)
+            if buffer.should_flush():
+                await _schedule_flush()
+            if offset >= len(trades):
+                break
+
+    async def _consume_frames() -> None:
+        # Pull whatever the reader has queued per wake-up so parsing and
+        # buffering run in batches, decoupled from socket reads.
+        while True:
+            frames = [await frame_queue.get()]
+            while not frame_queue.empty() and len(frames) < WS_BATCH_MAX_FRAMES:
+                frames.append(frame_queue.get_nowait())
+            # The stop sentinel is always the last frame ever queued.
+            stopping = frames[-1] is None
+            if stopping:
+                frames.pop()
+            await _buffer_frames(frames)
+            if stopping:
+                return
 
     stream_url = config.build_stream_url()
 
     @retry(wait=wait_exponential(multiplier=1, min=1, max=30), stop=stop_after_delay(3600))
     async def _run_stream() -> None:
-        async with websockets.connect(stream_url, ping_interval=20, ping_timeout=20) as ws:
+        nonlocal dropped_frames
+        # Opt out of permessage-deflate: if the server would negotiate it, we
+        # trade extra bandwidth on small trade frames for no inflate CPU.
+        async with websockets.connect(
+            stream_url,
+            ping_interval=20,
+            ping_timeout=20,
+            compression=None,
+        ) as ws:
             logging.info("Connected to %s", stream_url)
-            while not stop_event.is_set():
+            while True:
                 raw = await asyncio.wait_for(ws.recv(), timeout=30)
-                message = json.loads(raw)
-                if "result" in message:
-                    continue
-                trade = normalize_trade(message)
-                if buffer.add(trade):
-                    await flush(buffer, writer, config)
-
-    while not stop_event.is_set():
-        try:
-            await _run_stream()
-        except (asyncio.TimeoutError, websockets.ConnectionClosed) as exc:
-            logging.warning("WebSocket issue (%s), reconnecting...", exc)
-            await asyncio.sleep(1)
-        except RetryError as exc:
-            logging.error("Retry budget exhausted: %s", exc)
-            raise
-        except Exception:
-            logging.exception("Unexpected error inside stream loop; restarting in 5s")
-            await asyncio.sleep(5)
-
-    if buffer.records:
-        await flush(buffer, writer, config)
+                try:
+                    frame_queue.put_nowait(raw)
+                except asyncio.QueueFull:
+                    # Never stall the socket on a slow consumer; count the loss instead.
+                    dropped_frames += 1
+                    if dropped_frames % 1000 == 1:
+                        logging.warning("Trade queue full; dropped %s frames so far", dropped_frames)
+
+    async def _stream_forever() -> None:
+        while True:
+            try:
+                await _run_stream()
+            except (asyncio.TimeoutError, websockets.ConnectionClosed) as exc:
+                logging.warning("WebSocket issue (%s), reconnecting...", exc)
+                await asyncio.sleep(1)
+            except RetryError as exc:
+                logging.error("Retry budget exhausted: %s", exc)
+                raise
+            except Exception:
+                logging.exception("Unexpected error inside stream loop; restarting in 5s")
+                await asyncio.sleep(5)
+
+    async def _drain_and_flush() -> None:
+        # Let a live consumer finish what is queued rather than cancelling it
+        # while it may be waiting on an upload slot with trades still in hand.
+        # A dead one can never take the sentinel, so don't block on the put.
+        if not consumer.done():
+            sentinel = asyncio.ensure_future(frame_queue.put(None))
+            await asyncio.wait({consumer})
+            sentinel.cancel()
+        await _schedule_flush()
+        if pending_uploads:
+            await asyncio.gather(*pending_uploads)
+        upload_executor.shutdown()
+        if dropped_frames:
+            logging.warning("Dropped %s frames in total because the trade queue was full", dropped_frames)
+
+    consumer = asyncio.create_task(_consume_frames())
+    stream_task = asyncio.create_task(_stream_forever())
+    stop_task = asyncio.create_task(stop_event.wait())
+    try:
+        # The signal handler wakes the loop directly; the stream is cancelled
+        # rather than polling the stop flag on every frame.
+        await asyncio.wait({stream_task, stop_task, consumer}, return_when=asyncio.FIRST_COMPLETED)
+        if consumer.done():
+            # Buffering died and nothing drains the queue any more; stop instead
+            # of silently dropping every later frame.
+            consumer.result()
+        if stream_task.done():
+            stream_task.result()
+    finally:
+        # Persist whatever was buffered on every exit path, then re-raise.
+        stop_task.cancel()
+        if not stream_task.done():
+            stream_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await stream_task
+        await _drain_and_flush()
+    consumer.result()
     logging.info("Collector stopped cleanly")
 
 
-async def flush(buffer: TradeBuffer, writer: TradeBatchWriter, config: Config) -> None:
-    payload = buffer.flush()
+async def upload_batch(
+    payload: Dict[str, Any],
+    writer: TradeBatchWriter,
+    config: Config,
+    executor: ThreadPoolExecutor,
+) -> None:
     records = payload["records"]
-    if not records:
-        return
     window_start = payload["window_start"]
     window_end = payload["window_end"]
     byte_count = payload["byte_count"]
     assert isinstance(window_start, datetime) and isinstance(window_end, datetime)
 
-    logging.info(
-        "Flushing %s trades (~%s bytes) accumulated between %s and %s",
-        len(records),
-        byte_count,
-        window_start.isoformat(),
-        window_end.isoformat(),
-    )
-    key = writer.write(records, window_start)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(
+            "Flushing %s trades (~%s bytes) accumulated between %s and %s",
+            len(records),
+            byte_count,
+            window_start.isoformat(),
+            window_end.isoformat(),
+        )
+    try:
+        # DataFrame building, compression, and the S3 PUT all block; run them
+        # on the upload pool so the event loop never stalls on a flush.
+        key = await asyncio.get_running_loop().run_in_executor(executor, writer.write, records, window_start)
+    except Exception:
+        logging.exception("Failed to upload batch of %s trades", len(records))
+        return
     logging.info("Uploaded batch %s to %s (records=%s, approx_bytes=%s)", key, config.bucket, len(records), byte_count)
 
 
@@ -251,9 +430,12 @@ def configure_logging() -> None:
 def main() -> None:
     configure_logging()
     config = Config.from_env()
+    uvloop.install()
     try:
         asyncio.run(collect(config))
     except KeyboardInterrupt:
+        # Only reachable during startup, before collect() installs its loop
+        # signal handlers; afterwards SIGINT triggers the graceful shutdown.
         logging.info("Interrupted")
 
 
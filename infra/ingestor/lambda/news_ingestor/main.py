@@ -7,14 +7,28 @@ from xml.etree import ElementTree as ET
 
 import boto3
 import urllib3
-
-
-s3 = boto3.client("s3")
+from botocore.config import Config
+
+
+# Created at import so warm invocations reuse the client and its pool.
+s3 = boto3.client(
+    "s3",
+    config=Config(
+        max_pool_connections=10,
+        tcp_keepalive=True,
+        retries={"max_attempts": 3, "mode": "adaptive"},
+    ),
+)
 http = urllib3.PoolManager()
 
 BUCKET = os.environ.get("LANDING_BUCKET_NAME") or os.environ.get("BUCKET_NAME")
 NEWS_SOURCE = (os.environ.get("NEWS_SOURCE") or os.environ.get("NEWS_DATA_SOURCE") or "RSS").upper()
 CRYPTOPANIC_API_KEY = os.environ.get("CRYPTOPANIC_API_KEY", "")
+NEWS_KEY_PREFIX = f"Ext/{NEWS_SOURCE}/"
+
+# The Lambda zip carries only this file, so stick to the stdlib C encoder;
+# binding it once skips per-call JSONEncoder construction.
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
 
 
 def lambda_handler(event: Dict[str, Any], _context: Any) -> Dict[str, Any]:
@@ -29,7 +43,7 @@ def lambda_handler(event: Dict[str, Any], _context: Any) -> Dict[str, Any]:
         print(f"No items collected for source {NEWS_SOURCE}.")
         return {"status": "skipped", "count": 0}
 
-    key = build_s3_key(now, NEWS_SOURCE)
+    key = build_s3_key(now, NEWS_KEY_PREFIX)
     payload = {
         "collection_timestamp": now.isoformat(),
         "source_type": NEWS_SOURCE,
@@ -41,7 +55,7 @@ def lambda_handler(event: Dict[str, Any], _context: Any) -> Dict[str, Any]:
     s3.put_object(
         Bucket=BUCKET,
         Key=key,
-        Body=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        Body=_encode_json(payload).encode("utf-8"),
         ContentType="application/json",
     )
 
@@ -49,10 +63,13 @@ def lambda_handler(event: Dict[str, Any], _context: Any) -> Dict[str, Any]:
     return {"status": "success", "bucket": BUCKET, "key": key}
 
 
-def build_s3_key(timestamp: datetime, source: str) -> str:
-    """Build S3 key: Ext/{source}/YYYY/MM/DD/news-<ts>-<uuid>.json"""
-    run_suffix = f"{timestamp.strftime('%H%M%S')}-{str(uuid.uuid4())[:8]}"
-    return timestamp.strftime(f"Ext/{source}/%Y/%m/%d/news-{run_suffix}.json")
+def build_s3_key(timestamp: datetime, prefix: str) -> str:
+    """Build S3 key: {prefix}YYYY/MM/DD/news-<ts>-<uuid>.json (prefix is Ext/{source}/)"""
+    return (
+        f"{prefix}{timestamp.year:04d}/{timestamp.month:02d}/{timestamp.day:02d}/"
+        f"news-{timestamp.hour:02d}{timestamp.minute:02d}{timestamp.second:02d}"
+        f"-{uuid.uuid4().hex[:8]}.json"
+    )
 
 
 def fetch_cryptopanic() -> List[Dict[str, Any]]: